@@ -13,12 +13,19 @@ Feature: testing parts of the REST API
         And the asset pair response should contain the alias XBTUSD
         And the request should finish in under 1.5 seconds
 
+  Scenario: test get several asset pairs concurrently
+      Given I have an API connection
+        And I request the asset pairs XXBTZUSD,XETHZUSD,XXBTZEUR concurrently
+       Then I should receive a valid asset pair response for each pair
+        And each request should finish in under 1.5 seconds
+
   Scenario: test get open orders
       Given I have an API connection
         And I request the open orders
        Then I should receive a valid open orders response
         And the request should finish in under 1.5 seconds
 
+  @requires_otp
   Scenario: test get open orders with missing otp
       Given I have an API connection with missing otp
         And I request the open orders
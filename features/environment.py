@@ -0,0 +1,12 @@
+import os
+
+
+def before_scenario(context, scenario):
+    if 'requires_otp' in scenario.effective_tags and not os.environ.get('API_OTP'):
+        scenario.skip("API_OTP is not set, the key does not use 2FA")
+
+
+def after_scenario(context, scenario):
+    api = getattr(context, 'api', None)
+    if api is not None:
+        api.close()
@@ -10,6 +10,7 @@ def get_api_params():
         'key': os.environ.get('API_KEY'),
         'secret': os.environ.get('API_SEC'),
         'otp': os.environ.get('API_OTP'),
+        'cache': os.environ.get('API_CACHE', '').lower() in ('1', 'true', 'yes'),
     }
     return params
 
@@ -29,6 +30,12 @@ def step_impl(context, secs):
     elapsed = context.response.elapsed.total_seconds()
     assert elapsed < float(secs), f"response took {elapsed} seconds"
 
+@then('each request should finish in under {secs} seconds')
+def step_impl(context, secs):
+    for resp in context.responses:
+        elapsed = resp.elapsed.total_seconds()
+        assert elapsed < float(secs), f"response took {elapsed} seconds"
+
 
 @given('I request the server time')
 def step_impl(context):
@@ -37,9 +44,9 @@ def step_impl(context):
 @then('I should receive a valid server time response')
 def step_impl(context):
     CommonTests.http_checks(context.response)
-    CommonTests.basic_api_checks(context.response)
-    CommonTests.check_fields_server_time(context.response)
-    data = context.response.json()
+    data = CommonTests.parsed(context.response)
+    CommonTests.basic_api_checks(data)
+    CommonTests.check_fields_server_time(data)
     assert time.time() - data['result']['unixtime'] <= 50
 
 
@@ -51,12 +58,27 @@ def step_impl(context, pair):
 @then('I should receive a valid asset pair response')
 def step_impl(context):
     CommonTests.http_checks(context.response)
-    CommonTests.basic_api_checks(context.response)
-    CommonTests.check_fields_asset_pairs(context.response)
+    data = CommonTests.parsed(context.response)
+    CommonTests.basic_api_checks(data)
+    CommonTests.check_fields_asset_pairs(data)
+
+@given('I request the asset pairs {pairs} concurrently')
+def step_impl(context, pairs):
+    context.pairs = pairs.split(',')
+    context.responses = context.api.get_asset_pairs_concurrently(context.pairs)
+
+@then('I should receive a valid asset pair response for each pair')
+def step_impl(context):
+    for pair, resp in zip(context.pairs, context.responses):
+        CommonTests.http_checks(resp)
+        data = CommonTests.parsed(resp)
+        CommonTests.basic_api_checks(data)
+        CommonTests.check_fields_asset_pairs(data)
+        assert pair in data['result'], f"{pair} not in response"
 
 @then('the asset pair response should contain the alias {alias}')
 def step_impl(context, alias):
-    data = context.response.json()
+    data = CommonTests.parsed(context.response)
     print(data['result'][context.pair])
     assert data['result'][context.pair]['altname'] == alias
 
@@ -68,13 +90,14 @@ def step_impl(context):
 @then('I should receive a valid open orders response')
 def step_impl(context):
     CommonTests.http_checks(context.response)
-    CommonTests.basic_api_checks(context.response)
-    CommonTests.check_fields_open_orders(context.response)
+    data = CommonTests.parsed(context.response)
+    CommonTests.basic_api_checks(data)
+    CommonTests.check_fields_open_orders(data)
 
 @then('I should receive an error "{error}" response')
 def step_impl(context, error):
     CommonTests.http_checks(context.response)
-    data = context.response.json()
+    data = CommonTests.parsed(context.response)
     assert 'error' in data
     assert data['error'] == [error]
 